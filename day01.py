@@ -1,5 +1,9 @@
 # https://adventofcode.com/2023/day/1
 
+import collections
+import mmap
+import multiprocessing
+import os
 import re
 
 import pytest
@@ -58,11 +62,78 @@ DIGIT_SUBS = {word: num for num, word in enumerate(DIGITS.split("|"), start=1)}
 DIGIT_SUBS.update((d, int(d)) for d in "123456789")
 
 
+class Automaton:
+    """An Aho-Corasick matcher for finding a fixed set of words in text.
+
+    `words` is a dict mapping words to values.  The goto and failure links are
+    compiled into a transition dict per state, so matching is one dict lookup
+    per character.
+    """
+
+    def __init__(self, words):
+        goto = [{}]
+        fail = [0]
+        self.outputs = [[]]
+        for word, value in words.items():
+            state = 0
+            for ch in word:
+                if ch not in goto[state]:
+                    goto[state][ch] = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    self.outputs.append([])
+                state = goto[state][ch]
+            self.outputs[state].append((len(word), value))
+
+        # Breadth-first, so a state's failure state is finished before it is.
+        self.delta = [None] * len(goto)
+        self.delta[0] = dict(goto[0])
+        queue = collections.deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self.outputs[state] += self.outputs[fail[state]]
+            self.delta[state] = {**self.delta[fail[state]], **goto[state]}
+            for ch, nxt in goto[state].items():
+                fail[nxt] = self.delta[fail[state]].get(ch, 0)
+                queue.append(nxt)
+
+    def matches(self, text):
+        """Produce (start, value) for every match, overlaps included, in order of end."""
+        delta = self.delta
+        outputs = self.outputs
+        state = 0
+        for i, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            for length, value in outputs[state]:
+                yield (i - length + 1, value)
+
+    def first(self, text):
+        """Return the value of the first match to end in `text`, or None."""
+        delta = self.delta
+        outputs = self.outputs
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                return outputs[state][0][1]
+        return None
+
+
+def test_automaton():
+    automaton = Automaton({"he": 1, "she": 2, "his": 3, "hers": 4})
+    assert list(automaton.matches("ushers")) == [(1, 2), (2, 1), (2, 4)]
+    assert automaton.first("ahishers") == 3
+    assert automaton.first("xyz") is None
+
+
+DIGIT_AUTOMATON = Automaton(DIGIT_SUBS)
+# Matching the reversed words against the reversed line finds the last digit first.
+REVERSED_DIGIT_AUTOMATON = Automaton({word[::-1]: num for word, num in DIGIT_SUBS.items()})
+
+
 def digit_locations(line):
-    for i in range(len(line)):
-        for word, num in DIGIT_SUBS.items():
-            if line.startswith(word, i):
-                yield (i, num)
+    # No digit word contains another, so order of end is also order of start.
+    return DIGIT_AUTOMATON.matches(line)
 
 
 @pytest.mark.parametrize(
@@ -77,12 +148,31 @@ def test_digit_locations(line, places):
     assert list(digit_locations(line)) == places
 
 
+def first_last_digits(line):
+    """Find the first and last digits, scanning in from each end and stopping early."""
+    first = DIGIT_AUTOMATON.first(line)
+    last = REVERSED_DIGIT_AUTOMATON.first(reversed(line))
+    return first, last
+
+
+@pytest.mark.parametrize(
+    "line, digits",
+    [
+        ("eightwo", (8, 2)),
+        ("zoneight234", (1, 4)),
+        ("foooneight", (1, 8)),
+        ("treb7uchet", (7, 7)),
+        ("7pqrstsixteen", (7, 6)),
+    ],
+)
+def test_first_last_digits(line, digits):
+    assert first_last_digits(line) == digits
+
+
 def sum_two_digits_part2(lines):
     total = 0
     for line in lines:
-        locations = list(digit_locations(line))
-        first = locations[0][1]
-        last = locations[-1][1]
+        first, last = first_last_digits(line)
         total += first * 10 + last
     return total
 
@@ -95,5 +185,88 @@ if __name__ == "__main__":
     total = sum_two_digits_part2(open("day01_input.txt"))
     print(f"Part 2: {total = }")
 
+
+# Bytes-level mode for huge files: memory-map the file, split it into chunks at
+# newlines, and sum the chunks in worker processes.  Each line is matched in
+# place in the mapped bytes by one regex that captures the first and last
+# digits: the lookaheads let the two matches overlap, as in "eightwo".
+
+# Part 1 counts 0 as a digit, but part 2, like DIGIT_SUBS, doesn't.
+DIGIT_BYTES = {word.encode(): num for word, num in DIGIT_SUBS.items()}
+DIGIT_BYTES[b"0"] = 0
+FIRST_LAST_RES = {
+    1: re.compile(rb"^.*?(?=([0-9])).*(?=([0-9]))", re.MULTILINE),
+    2: re.compile(rb"^.*?(?=(%s|[1-9])).*(?=(%s|[1-9]))" % ((DIGITS.encode(),) * 2), re.MULTILINE),
+}
+
+
+def chunk_bounds(buf, chunk_size):
+    """Split `buf` into (start, end) pieces of about `chunk_size`, ending after newlines."""
+    start = 0
+    while start < len(buf):
+        end = buf.find(b"\n", start + chunk_size - 1)
+        end = len(buf) if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def test_chunk_bounds():
+    buf = b"ab\ncd\nefgh\nij"
+    assert list(chunk_bounds(buf, 1)) == [(0, 3), (3, 6), (6, 11), (11, 13)]
+    assert list(chunk_bounds(buf, 5)) == [(0, 6), (6, 11), (11, 13)]
+    assert list(chunk_bounds(buf, 100)) == [(0, 13)]
+
+
+def sum_chunk(args):
+    """Sum the calibration values for each of `parts` in one chunk of a file."""
+    fname, start, end, parts = args
+    with open(fname, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            totals = []
+            for part in parts:
+                total = 0
+                for m in FIRST_LAST_RES[part].finditer(mm, start, end):
+                    total += DIGIT_BYTES[m[1]] * 10 + DIGIT_BYTES[m[2]]
+                totals.append(total)
+    return totals
+
+
+def sum_calibrations(fname, parts=(1, 2), chunk_size=64 * 1024 * 1024, processes=None):
+    """Sum a file's calibration values for each of `parts`, in parallel.
+
+    All of the requested parts are computed in one pass over the file.
+    Returns a tuple of totals, one for each part.
+    """
+    if os.path.getsize(fname) == 0:
+        return (0,) * len(parts)
+    with open(fname, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            bounds = list(chunk_bounds(mm, chunk_size))
+    totals = [0] * len(parts)
+    jobs = [(fname, start, end, parts) for start, end in bounds]
+    with multiprocessing.Pool(processes) as pool:
+        for chunk_totals in pool.imap_unordered(sum_chunk, jobs):
+            totals = [t + ct for t, ct in zip(totals, chunk_totals)]
+    return tuple(totals)
+
+
+def test_sum_calibrations(tmp_path):
+    fname = tmp_path / "input.txt"
+    fname.write_text("\n".join(TEST_INPUT2) + "\n")
+    assert sum_calibrations(fname, parts=(2,)) == (281,)
+    assert sum_calibrations(fname, parts=(2,), chunk_size=10, processes=2) == (281,)
+    fname.write_text("\n".join(TEST_INPUT))
+    assert sum_calibrations(fname, chunk_size=10, processes=2) == (142, 142)
+    lines = ["a0b3c", "x0two0", "90"]
+    fname.write_text("\n".join(lines) + "\n")
+    assert sum_calibrations(fname, parts=(1,)) == (sum_two_digits(lines),)
+    assert sum_calibrations(fname, parts=(2,)) == (sum_two_digits_part2(lines),) == (154,)
+
+
+if __name__ == "__main__":
+    total1, total2 = sum_calibrations("day01_input.txt")
+    print(f"Parallel: {total1 = }, {total2 = }")
+
+
 # Clever way: replace "one" with "1ne", then overlaps will be replaced properly
 # and part 2 can be solved with part 1's code.
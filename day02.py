@@ -1,7 +1,20 @@
 # https://adventofcode.com/2023/day/2
 
+import array
+import bisect
+import itertools
+import operator
+import random
 import re
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
+
+import pytest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 TEST_INPUT = """\
 Game 1: 3 blue, 4 red; 1 red, 2 green, 6 blue; 2 green
@@ -51,13 +64,86 @@ def is_possible(handful, bag):
     )
 
 
+# Game logs are big, so rather than a Game per line and a Cubes per handful,
+# keep only what the puzzle needs: the maximum of each color per game, in
+# parallel arrays.
+
+CUBE_RE = re.compile(r"(\d+) (red|green|blue)")
+
+
+@dataclass
+class GameColumns:
+    ids: array.array = field(default_factory=lambda: array.array("q"))
+    red: array.array = field(default_factory=lambda: array.array("q"))
+    green: array.array = field(default_factory=lambda: array.array("q"))
+    blue: array.array = field(default_factory=lambda: array.array("q"))
+
+    def possible_ids(self, bag):
+        """Produce the ids of the games that are possible with `bag`."""
+        for id, red, green, blue in zip(self.ids, self.red, self.green, self.blue):
+            if red <= bag.red and green <= bag.green and blue <= bag.blue:
+                yield id
+
+    def powers(self):
+        return map(operator.mul, map(operator.mul, self.red, self.green), self.blue)
+
+    def possible_id_sum(self, bag):
+        """Sum the ids of the games that are possible with `bag`.
+
+        With NumPy, the columns are viewed as int64 arrays and masked at once.
+        """
+        if np is None:
+            return sum(self.possible_ids(bag))
+        ids, red, green, blue = self._arrays()
+        possible = (red <= bag.red) & (green <= bag.green) & (blue <= bag.blue)
+        return int(ids[possible].sum())
+
+    def power_sum(self):
+        if np is None:
+            return sum(self.powers())
+        _, red, green, blue = self._arrays()
+        return int((red * green * blue).sum())
+
+    def _arrays(self):
+        columns = (self.ids, self.red, self.green, self.blue)
+        return [np.asarray(column, dtype=np.int64) for column in columns]
+
+
+def parse_game_columns(lines):
+    """Parse games in one pass, keeping only the per-game maximum of each color."""
+    columns = GameColumns()
+    for line in lines:
+        game, _, handfuls = line.partition(": ")
+        maxes = {"red": 0, "green": 0, "blue": 0}
+        for num, color in CUBE_RE.findall(handfuls):
+            maxes[color] = max(maxes[color], int(num))
+        columns.ids.append(int(game.split()[1]))
+        columns.red.append(maxes["red"])
+        columns.green.append(maxes["green"])
+        columns.blue.append(maxes["blue"])
+    return columns
+
+
+def test_parse_game_columns():
+    columns = parse_game_columns(TEST_INPUT)
+    assert list(columns.ids) == [1, 2, 3, 4, 5]
+    assert list(columns.red) == [4, 1, 20, 14, 6]
+    assert list(columns.green) == [2, 3, 13, 3, 3]
+    assert list(columns.blue) == [6, 4, 6, 15, 2]
+
+
+@pytest.mark.skipif(np is None, reason="NumPy is not installed")
+def test_column_sums_array():
+    columns = parse_game_columns(TEST_INPUT)
+    for r, g, b in itertools.product(range(0, 22, 3), range(0, 15, 3), range(0, 17, 3)):
+        bag = Cubes(r, g, b)
+        assert columns.possible_id_sum(bag) == sum(columns.possible_ids(bag))
+    assert columns.power_sum() == sum(columns.powers())
+
+
 def part1(lines):
     bag = Cubes(red=12, green=13, blue=14)
-    total = 0
-    for game in parse_games(lines):
-        if all(is_possible(handful, bag) for handful in game.handfuls):
-            total += game.id
-    return total
+    return parse_game_columns(lines).possible_id_sum(bag)
 
 
 def test_part1():
@@ -90,10 +176,7 @@ def test_fewest_cubes():
 
 
 def part2(lines):
-    total = 0
-    for game in parse_games(lines):
-        total += fewest_cubes(game).power()
-    return total
+    return parse_game_columns(lines).power_sum()
 
 
 def test_part2():
@@ -103,3 +186,85 @@ def test_part2():
 if __name__ == "__main__":
     total = part2(open("day02_input.txt"))
     print(f"Part 2: {total = }")
+
+
+# Many bags against one game log: a game is possible for a bag when the bag
+# dominates the game's fewest cubes in all three colors.  Compress each color
+# to its sorted distinct values, and build 3D prefix sums of game counts and
+# id sums over the compressed grid.  A bag is then three bisects and a lookup.
+
+class BagIndex:
+    def __init__(self, fewests):
+        """`fewests` is an iterable of (id, Cubes) pairs, the fewest cubes for each game."""
+        fewests = list(fewests)
+        self.reds = sorted({cubes.red for _, cubes in fewests})
+        self.greens = sorted({cubes.green for _, cubes in fewests})
+        self.blues = sorted({cubes.blue for _, cubes in fewests})
+        nr, ng, nb = len(self.reds), len(self.greens), len(self.blues)
+        self.shape = (nr, ng, nb)
+        counts = [0] * (nr * ng * nb)
+        id_sums = [0] * (nr * ng * nb)
+        for id, cubes in fewests:
+            i = self._cell(
+                bisect.bisect_left(self.reds, cubes.red),
+                bisect.bisect_left(self.greens, cubes.green),
+                bisect.bisect_left(self.blues, cubes.blue),
+            )
+            counts[i] += 1
+            id_sums[i] += id
+        # Accumulate along each axis in turn to get the prefix sums.
+        for stride, n in [(ng * nb, nr), (nb, ng), (1, nb)]:
+            for i in range(len(counts)):
+                if (i // stride) % n:
+                    counts[i] += counts[i - stride]
+                    id_sums[i] += id_sums[i - stride]
+        self.counts = counts
+        self.id_sums = id_sums
+
+    def _cell(self, r, g, b):
+        _, ng, nb = self.shape
+        return (r * ng + g) * nb + b
+
+    def query(self, bag):
+        """Return (count, sum of ids) of the games possible with `bag`."""
+        r = bisect.bisect_right(self.reds, bag.red) - 1
+        g = bisect.bisect_right(self.greens, bag.green) - 1
+        b = bisect.bisect_right(self.blues, bag.blue) - 1
+        if r < 0 or g < 0 or b < 0:
+            return 0, 0
+        i = self._cell(r, g, b)
+        return self.counts[i], self.id_sums[i]
+
+    def query_many(self, bags):
+        return [self.query(bag) for bag in bags]
+
+
+def bag_index(lines):
+    columns = parse_game_columns(lines)
+    return BagIndex(zip(columns.ids, map(Cubes, columns.red, columns.green, columns.blue)))
+
+
+def test_bag_index():
+    index = bag_index(TEST_INPUT)
+    assert index.query(Cubes(red=12, green=13, blue=14)) == (3, 8)
+    assert index.query(Cubes(red=100, green=100, blue=100)) == (5, 15)
+    assert index.query(Cubes(red=0, green=100, blue=100)) == (0, 0)
+    assert index.query(Cubes(red=4, green=3, blue=6)) == (2, 3)
+
+
+def test_bag_index_agrees():
+    columns = parse_game_columns(TEST_INPUT)
+    index = bag_index(TEST_INPUT)
+    for r, g, b in itertools.product(range(22), range(15), range(17)):
+        bag = Cubes(r, g, b)
+        ids = list(columns.possible_ids(bag))
+        assert index.query(bag) == (len(ids), sum(ids))
+
+
+if __name__ == "__main__":
+    index = bag_index(open("day02_input.txt"))
+    bags = [Cubes(*(random.randrange(25) for _ in range(3))) for _ in range(100_000)]
+    start = time.perf_counter()
+    index.query_many(bags)
+    elapsed = time.perf_counter() - start
+    print(f"Bag index: {len(bags)} bags in {elapsed:.3f}s, {len(bags) / elapsed:,.0f} bags/s")
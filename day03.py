@@ -1,7 +1,8 @@
 # https://adventofcode.com/2023/day/3
 
+import collections
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from helpers import *
 
@@ -45,9 +46,12 @@ def find_numbers(lines):
             yield Number(match.start(), lineno, len(match[0]), int(match[0]))
 
 
+SYMBOL_RE = re.compile(r"[^.\d\s]")
+
+
 def find_symbols(lines):
     for lineno, line in enumerate(lines):
-        for match in re.finditer(r"[^.\d\s]", line):
+        for match in SYMBOL_RE.finditer(line):
             yield (match.start(), lineno, match[0])
 
 
@@ -94,15 +98,44 @@ def test_neighboring_locations():
     }
 
 
+class Schematic:
+    """The numbers in a schematic, with a grid labeling each cell with its number's id.
+
+    A number's id is its index in `numbers`.  Cells with no number are None.
+    """
+
+    def __init__(self, lines):
+        lines = list(lines)
+        self.numbers = list(find_numbers(lines))
+        self.labels = [[None] * len(line) for line in lines]
+        for id, num in enumerate(self.numbers):
+            self.labels[num.y][num.x : num.x + num.ndigits] = [id] * num.ndigits
+
+    def adjacent_ids(self, x, y):
+        """Return the sorted ids of the numbers neighboring (x, y)."""
+        ids = set()
+        for row in self.labels[max(y - 1, 0) : y + 2]:
+            for id in row[max(x - 1, 0) : x + 2]:
+                if id is not None:
+                    ids.add(id)
+        return sorted(ids)
+
+
+def test_schematic():
+    schematic = Schematic(TEST_INPUT)
+    assert schematic.labels[0] == [0, 0, 0, None, None, 1, 1, 1, None, None]
+    assert schematic.adjacent_ids(3, 1) == [0, 2]
+    assert schematic.adjacent_ids(9, 9) == []
+    assert schematic.adjacent_ids(0, 0) == [0]
+
+
 def part1(lines):
-    numbers = list(find_numbers(lines))
-    symbols = list(find_symbols(lines))
-    symbol_spots = set((x, y) for x, y, s in symbols)
-    part_numbers = []
-    for num in numbers:
-        if num.neighboring_locations() & symbol_spots:
-            part_numbers.append(num)
-    return sum(pnum.num for pnum in part_numbers)
+    lines = list(lines)
+    schematic = Schematic(lines)
+    part_ids = set()
+    for x, y, _ in find_symbols(lines):
+        part_ids.update(schematic.adjacent_ids(x, y))
+    return sum(schematic.numbers[id].num for id in part_ids)
 
 
 def test_part1():
@@ -115,18 +148,13 @@ if __name__ == "__main__":
 
 
 def gears(lines):
-    numbers = list(find_numbers(lines))
-    stars = [(x, y) for x, y, s in find_symbols(lines) if s == "*"]
-    for star in stars:
-        adjacent_nums = []
-        possible_rows = {star[1] - 1, star[1], star[1] + 1}
-        for num in numbers:
-            if num.y not in possible_rows:
-                continue
-            if star in num.neighboring_locations():
-                adjacent_nums.append(num)
-        if len(adjacent_nums) == 2:
-            yield tuple(anum.num for anum in adjacent_nums)
+    lines = list(lines)
+    schematic = Schematic(lines)
+    for x, y, s in find_symbols(lines):
+        if s == "*":
+            ids = schematic.adjacent_ids(x, y)
+            if len(ids) == 2:
+                yield tuple(schematic.numbers[id].num for id in ids)
 
 
 def test_gears():
@@ -144,3 +172,81 @@ def test_part2():
 if __name__ == "__main__":
     answer = part2(file_lines("day03_input.txt"))
     print(f"Part 2: {answer = }")
+
+
+# Streaming: adjacency only spans three rows, so read the schematic one row at
+# a time and keep just a window of three rows.  Once the row below a row has
+# arrived, that row's part numbers and gears are settled.
+
+@dataclass
+class Row:
+    line: str = ""
+    numbers: list[Number] = field(default_factory=list)
+    labels: list[int | None] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, line, y):
+        numbers = list(find_numbers([line]))
+        labels = [None] * len(line)
+        for i, num in enumerate(numbers):
+            num.y = y
+            labels[num.x : num.x + num.ndigits] = [i] * num.ndigits
+        return cls(line, numbers, labels)
+
+
+def settle_row(window):
+    """Produce the ("part", num) and ("gear", ratio) results for the middle row of `window`."""
+    row = window[1]
+    for num in row.numbers:
+        start = max(num.x - 1, 0)
+        end = num.x + num.ndigits + 1
+        if any(SYMBOL_RE.search(r.line, start, end) for r in window):
+            yield "part", num.num
+    for match in re.finditer(r"\*", row.line):
+        x = match.start()
+        adjacent = set()
+        for nrow, r in enumerate(window):
+            for i in r.labels[max(x - 1, 0) : x + 2]:
+                if i is not None:
+                    adjacent.add((nrow, i))
+        if len(adjacent) == 2:
+            (r1, i1), (r2, i2) = sorted(adjacent)
+            yield "gear", window[r1].numbers[i1].num * window[r2].numbers[i2].num
+
+
+def stream_schematic(lines):
+    """Produce ("part", num) and ("gear", ratio) results, reading `lines` one at a time."""
+    window = collections.deque([Row()], maxlen=3)
+    for y, line in enumerate(lines):
+        window.append(Row.parse(line.rstrip("\n"), y))
+        if len(window) == 3:
+            yield from settle_row(window)
+    window.append(Row())
+    if len(window) == 3:
+        yield from settle_row(window)
+
+
+def test_stream_schematic():
+    results = list(stream_schematic(TEST_INPUT))
+    assert [num for kind, num in results if kind == "part"] == [
+        467, 35, 633, 617, 592, 755, 664, 598,
+    ]
+    assert [ratio for kind, ratio in results if kind == "gear"] == [467 * 35, 755 * 598]
+
+
+def stream_totals(lines):
+    """Return the part 1 and part 2 answers in one streaming pass."""
+    totals = {"part": 0, "gear": 0}
+    for kind, num in stream_schematic(lines):
+        totals[kind] += num
+    return totals["part"], totals["gear"]
+
+
+def test_stream_totals():
+    assert stream_totals(TEST_INPUT) == (4361, 467835)
+
+
+if __name__ == "__main__":
+    with open("day03_input.txt") as f:
+        part1_answer, part2_answer = stream_totals(f)
+    print(f"Streaming: {part1_answer = }, {part2_answer = }")
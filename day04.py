@@ -1,7 +1,8 @@
 # https://adventofcode.com/2023/day/04
 
+import collections
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from helpers import *
 
@@ -17,11 +18,25 @@ Card 6: 31 18 13 56 72 | 74 77 10 23 35 67 36 11
 )
 
 
-@dataclass
+def bitmask(nums):
+    """Make an int with a bit set for each of the numbers."""
+    mask = 0
+    for num in nums:
+        mask |= 1 << num
+    return mask
+
+
+@dataclass(slots=True)
 class ScratchCard:
+    # The number lists are stored as bitmasks, and the number of matches is
+    # computed once with an AND and a popcount.
     id: int
-    winning: set[int]
-    have: set[int]
+    winning: int
+    have: int
+    nmatches: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.nmatches = (self.winning & self.have).bit_count()
 
     @classmethod
     def parse(cls, line):
@@ -29,26 +44,32 @@ class ScratchCard:
         winning, _, have = rest.partition(" | ")
         return cls(
             id=int(card.split()[-1]),
-            winning=set(map(int, winning.split())),
-            have=set(map(int, have.split())),
+            winning=bitmask(map(int, winning.split())),
+            have=bitmask(map(int, have.split())),
         )
 
     def matches(self):
-        return len(self.winning & self.have)
+        return self.nmatches
 
     def points(self):
-        if self.matches() == 0:
+        if self.nmatches == 0:
             return 0
         else:
-            return 2 ** (self.matches() - 1)
+            return 2 ** (self.nmatches - 1)
 
 
 def test_parse():
     assert ScratchCard.parse("Card 17: 45 32 20 | 45 34 23 1") == ScratchCard(
-        id=17, winning={20, 32, 45}, have={34, 23, 1, 45}
+        id=17, winning=bitmask({20, 32, 45}), have=bitmask({34, 23, 1, 45})
     )
 
 
+def test_matches():
+    cards = [ScratchCard.parse(line) for line in TEST_INPUT]
+    assert [card.matches() for card in cards] == [4, 2, 2, 1, 0, 0]
+    assert [card.points() for card in cards] == [8, 2, 2, 1, 0, 0]
+
+
 def part1(lines):
     cards = [ScratchCard.parse(line) for line in lines]
     return sum(card.points() for card in cards)
@@ -63,16 +84,35 @@ if __name__ == "__main__":
     print(f"Part 1: {answer = }")
 
 
-def part2(lines):
-    cards = [ScratchCard.parse(line) for line in lines]
-    counts = dict.fromkeys([c.id for c in cards], 1)
+def copy_counts(cards):
+    """Produce the number of copies of each card, consuming the cards as they arrive.
+
+    The copies won are kept as a difference array over the upcoming cards:
+    winning copies of the next m cards adds at the first and subtracts just
+    past the last.  Only the pending window of differences is kept.
+    """
+    diffs = collections.deque()
+    won = 0
     for card in cards:
-        id = card.id
-        num_cards = counts[id]
+        if diffs:
+            won += diffs.popleft()
+        num_cards = 1 + won
+        yield num_cards
         matches = card.matches()
-        for next_id in range(id + 1, id + matches + 1):
-            counts[next_id] += num_cards
-    return sum(counts.values())
+        if matches:
+            while len(diffs) <= matches:
+                diffs.append(0)
+            diffs[0] += num_cards
+            diffs[matches] -= num_cards
+
+
+def test_copy_counts():
+    cards = (ScratchCard.parse(line) for line in TEST_INPUT)
+    assert list(copy_counts(cards)) == [1, 2, 4, 8, 14, 1]
+
+
+def part2(lines):
+    return sum(copy_counts(ScratchCard.parse(line) for line in lines))
 
 
 def test_part2():
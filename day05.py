@@ -1,11 +1,19 @@
 # https://adventofcode.com/2023/day/05
 
-import itertools
+import bisect
+import functools
+import math
 import re
+import timeit
 from dataclasses import dataclass
 
 import pytest
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from helpers import *
 
 TEST_INPUT = string_lines(
@@ -51,6 +59,146 @@ humidity-to-location map:
 # End is not included, as with range().
 
 
+class IntervalSet:
+    """A set of numbers, as sorted, disjoint (start, end) ranges.
+
+    Overlapping and adjacent ranges are merged, so no two ranges touch.
+    Iterating produces the (start, end) tuples in order.
+    """
+
+    def __init__(self, ranges=()):
+        self.ranges = []
+        for start, end in sorted(ranges):
+            if start >= end:
+                continue
+            if self.ranges and start <= self.ranges[-1][1]:
+                last_start, last_end = self.ranges[-1]
+                self.ranges[-1] = (last_start, max(last_end, end))
+            else:
+                self.ranges.append((start, end))
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __eq__(self, other):
+        return isinstance(other, IntervalSet) and self.ranges == other.ranges
+
+    def __repr__(self):
+        return f"IntervalSet({self.ranges!r})"
+
+    def __and__(self, other):
+        """The intersection of two IntervalSets, by sweeping the two sorted lists."""
+        result = []
+        i = j = 0
+        while i < len(self.ranges) and j < len(other.ranges):
+            (start1, end1), (start2, end2) = self.ranges[i], other.ranges[j]
+            if max(start1, start2) < min(end1, end2):
+                result.append((max(start1, start2), min(end1, end2)))
+            if end1 < end2:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet(result)
+
+
+def test_interval_set():
+    assert IntervalSet([(10, 20), (0, 5), (5, 7), (15, 25), (30, 30)]).ranges == [
+        (0, 7),
+        (10, 25),
+    ]
+    assert len(IntervalSet()) == 0
+    assert IntervalSet([(0, 10), (20, 30)]) & IntervalSet([(5, 25), (28, 40)]) == IntervalSet(
+        [(5, 10), (20, 25), (28, 30)]
+    )
+
+
+@dataclass
+class Piecewise:
+    """A function of numbers made of segments that each add an offset.
+
+    Segment i covers starts[i] <= num < starts[i+1] (the last one runs to
+    infinity) and maps num to num + offsets[i].  starts[0] is -inf, so every
+    number is in some segment.  Adjacent segments have different offsets.
+    """
+    starts: list[int]
+    offsets: list[int]
+
+    @classmethod
+    def from_segments(cls, segments):
+        """Make a Piecewise from sorted (start, offset) pairs, cleaning them up."""
+        starts = []
+        offsets = []
+        for start, offset in segments:
+            if starts and starts[-1] == start:
+                # The previous segment was empty.
+                starts.pop()
+                offsets.pop()
+            if offsets and offsets[-1] == offset:
+                continue
+            starts.append(start)
+            offsets.append(offset)
+        return cls(starts, offsets)
+
+    def __getitem__(self, num):
+        return num + self.offsets[bisect.bisect_right(self.starts, num) - 1]
+
+    @functools.cached_property
+    def arrays(self):
+        """The finite starts and the offsets, as NumPy arrays, made once."""
+        return np.array(self.starts[1:], dtype=np.int64), np.array(self.offsets, dtype=np.int64)
+
+    def map_array(self, nums):
+        """Map a NumPy array of numbers, with one searchsorted and an offset add."""
+        starts, offsets = self.arrays
+        return nums + offsets[np.searchsorted(starts, nums, side="right")]
+
+    @functools.cached_property
+    def inverse(self):
+        """The segments from the destination side: (dest start, dest end, offset), sorted."""
+        ends = self.starts[1:] + [math.inf]
+        return sorted(
+            (start + offset, end + offset, offset)
+            for start, end, offset in zip(self.starts, ends, self.offsets)
+        )
+
+    def preimage(self, numbers):
+        """Find all the numbers that map into the ranges `numbers`, as an IntervalSet."""
+        ranges = IntervalSet(numbers).ranges
+        range_starts = [start for start, _ in ranges]
+        result = []
+        for dstart, dend, offset in self.inverse:
+            i = max(bisect.bisect_right(range_starts, dstart) - 1, 0)
+            while i < len(ranges) and ranges[i][0] < dend:
+                start = max(ranges[i][0], dstart)
+                end = min(ranges[i][1], dend)
+                if start < end:
+                    result.append((start - offset, end - offset))
+                i += 1
+        return IntervalSet(result)
+
+    def then(self, other):
+        """Compose with `other`: the result maps num to other[self[num]]."""
+        segments = []
+        ends = self.starts[1:] + [math.inf]
+        for start, end, offset in zip(self.starts, ends, self.offsets):
+            # This segment's image is [start + offset, end + offset): split it
+            # at each of other's segment starts inside it.
+            i = bisect.bisect_right(other.starts, start + offset) - 1
+            while True:
+                segments.append((start, offset + other.offsets[i]))
+                i += 1
+                if i == len(other.starts) or other.starts[i] >= end + offset:
+                    break
+                start = other.starts[i] - offset
+        return Piecewise.from_segments(segments)
+
+
+IDENTITY = Piecewise([-math.inf], [0])
+
+
 @dataclass
 class MapRange:
     dstart: int
@@ -58,7 +206,7 @@ class MapRange:
     rlen: int
 
     def __contains__(self, num):
-        return num in range(self.sstart, self.sstart + self.rlen)
+        return self.sstart <= num < self.sstart + self.rlen
 
     def __getitem__(self, num):
         return num - self.sstart + self.dstart
@@ -68,38 +216,42 @@ class MapRange:
 class Map:
     map_ranges: list[MapRange]
 
+    @functools.cached_property
+    def piecewise(self):
+        """This map as a Piecewise function, computed once."""
+        segments = [(-math.inf, 0)]
+        for r in sorted(self.map_ranges, key=lambda r: r.sstart):
+            segments.append((r.sstart, r.dstart - r.sstart))
+            segments.append((r.sstart + r.rlen, 0))
+        return Piecewise.from_segments(segments)
+
     def __getitem__(self, num):
-        for r in self.map_ranges:
-            if num in r:
-                return r[num]
-        else:
-            return num
+        return self.piecewise[num]
+
+    def preimage(self, numbers):
+        return self.piecewise.preimage(numbers)
 
     def map_numbers(self, numbers):
-        """Map a set of number ranges through this map, producing a new set of number ranges."""
-        to_map = numbers
-        result = set()
-        for map_range in self.map_ranges:
-            next_to_map = []
-            sstart = map_range.sstart
-            send = map_range.sstart + map_range.rlen
-            for start, end in to_map:
-                if start < sstart:
-                    # The portion of numbers less than the mapped range.
-                    next_to_map.append((start, min(end, sstart)))
-                if (send >= start) and (end >= sstart):
-                    # The ranges overlap.
-                    # https://nedbatchelder.com/blog/201310/range_overlap_in_two_compares.html
-                    nstart = max(start, sstart)
-                    nend = min(end, send)
-                    if nstart != nend:
-                        mapped = (map_range[nstart], map_range[nend])
-                        result.add(mapped)
-                if end > send:
-                    next_to_map.append((max(start, send), end))
-            to_map = next_to_map
-        result.update(to_map)
-        return result
+        """Map a set of number ranges through this map, producing a new IntervalSet.
+
+        The sorted ranges are swept together with the sorted segments of this
+        map's Piecewise function, so each is visited once.
+        """
+        starts = self.piecewise.starts
+        offsets = self.piecewise.offsets
+        mapped = []
+        i = 0
+        for start, end in IntervalSet(numbers):
+            while i + 1 < len(starts) and starts[i + 1] <= start:
+                i += 1
+            while True:
+                seg_end = starts[i + 1] if i + 1 < len(starts) else math.inf
+                mapped.append((start + offsets[i], min(end, seg_end) + offsets[i]))
+                if end <= seg_end:
+                    break
+                start = seg_end
+                i += 1
+        return IntervalSet(mapped)
 
 
 @dataclass
@@ -107,13 +259,70 @@ class Almanac:
     seeds: list[int]
     maps: list[Map]
 
+    @functools.cached_property
+    def piecewise(self):
+        """All of the maps composed into one Piecewise function, computed once."""
+        return functools.reduce(Piecewise.then, (map.piecewise for map in self.maps), IDENTITY)
+
     def __getitem__(self, num):
-        for map in self.maps:
-            num = map[num]
-        return num
+        return self.piecewise[num]
+
+    def lookup_many(self, seeds):
+        """Map a batch of seeds to locations.
+
+        With NumPy, `seeds` is converted to an int64 array and the whole array
+        is mapped at once.  Without it, a list is returned.
+        """
+        if np is None:
+            return [self[num] for num in seeds]
+        return self.piecewise.map_array(np.asarray(seeds, dtype=np.int64))
+
+    def min_location(self, seeds):
+        locations = self.lookup_many(seeds)
+        if np is None:
+            return min(locations)
+        return int(locations.min())
+
+    def preimage(self, locations):
+        """Find the seeds that reach the ranges `locations`, as an IntervalSet."""
+        return self.piecewise.preimage(locations)
+
+    def smallest_reachable(self, seeds):
+        """Find the smallest location reachable from the ranges `seeds`.
+
+        Works backward from the lowest locations: each destination segment of
+        the composed maps is pulled back to its own source range and
+        intersected with the seeds.
+        """
+        seeds = IntervalSet(seeds)
+        best = None
+        for dstart, dend, offset in self.piecewise.inverse:
+            if best is not None and dstart >= best:
+                break
+            reached = IntervalSet([(dstart - offset, dend - offset)]) & seeds
+            if reached:
+                location = reached.ranges[0][0] + offset
+                if best is None or location < best:
+                    best = location
+        return best
 
 
 def parse_almanac(lines):
+    """Parse the almanac in one pass over `lines`, which can be any iterable of lines."""
+    seeds = []
+    maps = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("seeds:"):
+            seeds = [int(n) for n in line.split()[1:]]
+        elif line.endswith("map:"):
+            maps.append(Map([]))
+        elif line:
+            maps[-1].map_ranges.append(MapRange(*map(int, line.split())))
+    return Almanac(seeds, maps)
+
+
+def parse_almanac_eval(lines):
     """Transform the input into Python, and evaluate it!"""
     python = []
     python.append("Almanac(")
@@ -137,6 +346,21 @@ def parse_almanac(lines):
     return eval("\n".join(python))
 
 
+def test_parse_almanac():
+    almanac = parse_almanac(iter(TEST_INPUT))
+    assert almanac == parse_almanac_eval(TEST_INPUT)
+    assert almanac.seeds == [79, 14, 55, 13]
+    assert len(almanac.maps) == 7
+    assert almanac.maps[0] == Map([MapRange(50, 98, 2), MapRange(52, 50, 48)])
+
+
+if __name__ == "__main__":
+    lines = file_lines("day05_input.txt")
+    for parser in [parse_almanac, parse_almanac_eval]:
+        secs = timeit.timeit(lambda: parser(lines), number=100) / 100
+        print(f"{parser.__name__}: {secs * 1000:.3f} ms per parse")
+
+
 def test_one_range():
     almanac = parse_almanac(TEST_INPUT)
     results = [almanac.maps[0][num] for num in [79, 14, 55, 13]]
@@ -149,10 +373,37 @@ def test_almanac():
     assert results == [82, 43, 86, 35]
 
 
+def test_piecewise():
+    pw = Map([MapRange(50, 98, 2), MapRange(52, 50, 48)]).piecewise
+    assert pw == Piecewise([-math.inf, 50, 98, 100], [0, 2, -48, 0])
+    assert [pw[n] for n in [0, 49, 50, 97, 98, 99, 100]] == [0, 49, 52, 99, 50, 51, 100]
+
+
+def test_composed_almanac():
+    almanac = parse_almanac(TEST_INPUT)
+    for num in range(120):
+        chained = num
+        for map in almanac.maps:
+            chained = next((r[chained] for r in map.map_ranges if chained in r), chained)
+        assert almanac[num] == chained
+
+
+def test_lookup_many():
+    almanac = parse_almanac(TEST_INPUT)
+    assert list(almanac.lookup_many([79, 14, 55, 13])) == [82, 43, 86, 35]
+    assert almanac.min_location([79, 14, 55, 13]) == 35
+
+
+@pytest.mark.skipif(np is None, reason="NumPy is not installed")
+def test_lookup_many_array():
+    almanac = parse_almanac(TEST_INPUT)
+    seeds = np.arange(120)
+    assert almanac.lookup_many(seeds).tolist() == [almanac[num] for num in range(120)]
+
+
 def part1(lines):
     almanac = parse_almanac(lines)
-    results = [almanac[num] for num in almanac.seeds]
-    return min(results)
+    return almanac.min_location(almanac.seeds)
 
 
 def test_part1():
@@ -164,9 +415,14 @@ if __name__ == "__main__":
     print(f"Part 1: {answer = }")
 
 
+def seed_ranges(almanac):
+    seeds = almanac.seeds
+    return IntervalSet((s, s + l) for s, l in zip(seeds[::2], seeds[1::2]))
+
+
 def part2(lines):
     almanac = parse_almanac(lines)
-    numbers = [(s, s+l) for s, l in itertools.batched(almanac.seeds, 2)]
+    numbers = seed_ranges(almanac)
     for map in almanac.maps:
         numbers = map.map_numbers(numbers)
     smallest = min(numbers)[0]
@@ -180,3 +436,61 @@ def test_part2():
 if __name__ == "__main__":
     answer = part2(file_lines("day05_input.txt"))
     print(f"Part 2: {answer = }")
+
+
+def test_map_numbers():
+    map = Map([MapRange(50, 98, 2), MapRange(52, 50, 48)])
+    numbers = map.map_numbers([(45, 55), (90, 101)])
+    assert numbers == IntervalSet([(45, 50), (52, 57), (92, 100), (50, 52), (100, 101)])
+    assert numbers.ranges == [(45, 57), (92, 101)]
+
+
+def stage_sizes(almanac):
+    """Return the number of ranges after each stage of mapping the seed ranges."""
+    numbers = seed_ranges(almanac)
+    sizes = [len(numbers)]
+    for map in almanac.maps:
+        numbers = map.map_numbers(numbers)
+        sizes.append(len(numbers))
+    return sizes
+
+
+def test_stage_sizes():
+    assert stage_sizes(parse_almanac(TEST_INPUT)) == [2, 2, 2, 3, 3, 4, 4, 4]
+
+
+if __name__ == "__main__":
+    almanac = parse_almanac(file_lines("day05_input.txt"))
+    secs = timeit.timeit(lambda: stage_sizes(almanac), number=100) / 100
+    print(f"Ranges per stage: {stage_sizes(almanac)}, {secs * 1000:.3f} ms per run")
+
+
+def test_preimage():
+    almanac = parse_almanac(TEST_INPUT)
+    assert almanac.maps[0].preimage([(50, 53)]) == IntervalSet([(50, 51), (98, 100)])
+    assert almanac.preimage([(46, 47)]) == IntervalSet([(82, 83)])
+    for seed in almanac.preimage([(40, 60)]):
+        assert 40 <= almanac[seed[0]] < 60
+    assert sum(end - start for start, end in almanac.preimage([(40, 60)])) == 20
+
+
+def part2_backward(lines):
+    almanac = parse_almanac(lines)
+    return almanac.smallest_reachable(seed_ranges(almanac))
+
+
+def test_part2_backward():
+    assert part2_backward(TEST_INPUT) == 46
+
+
+def test_part2_backward_overlapping():
+    # Seeds 0-9 map to 100-109, but the identity segment also covers 100-109.
+    lines = ["seeds: 0 1", "", "seed-to-soil map:", "100 0 10"]
+    assert part2(lines) == part2_backward(lines) == 100
+    lines = ["seeds: 0 10 105 3", "", "seed-to-soil map:", "100 0 10"]
+    assert part2(lines) == part2_backward(lines) == 100
+
+
+if __name__ == "__main__":
+    answer = part2_backward(file_lines("day05_input.txt"))
+    print(f"Part 2 backward: {answer = }")
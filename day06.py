@@ -2,6 +2,12 @@
 
 import math
 
+import pytest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 TEST_INPUT = [
     (7, 9),
@@ -30,7 +36,46 @@ def test_distances():
 
 
 def ways_to_beat_record(race_time, record):
-    return sum(dist > record for dist in distances(race_time))
+    """Count the button times that beat the record, from the quadratic.
+
+    (race_time - b) * b > record holds for b strictly between the roots of
+    b**2 - race_time * b + record.  The integer square root gets within one
+    of the lower root, then it's nudged to the first winning button time.
+    The winning times are symmetric around race_time / 2.
+    """
+    disc = race_time * race_time - 4 * record
+    if disc <= 0:
+        return 0
+    low = max((race_time - math.isqrt(disc)) // 2, 0)
+    while low > 0 and distance(race_time, low - 1) > record:
+        low -= 1
+    while low <= race_time // 2 and distance(race_time, low) <= record:
+        low += 1
+    return max(race_time - 2 * low + 1, 0)
+
+
+def ways_to_beat_records(races):
+    """Count the ways to win each of a batch of (race_time, record) pairs.
+
+    With NumPy, races whose numbers fit in int64 are solved as arrays.
+    Otherwise, this returns a list.
+    """
+    races = list(races)
+    if np is None or not all(t < 2**31 and abs(r) < 2**60 for t, r in races):
+        return [ways_to_beat_record(race_time, record) for race_time, record in races]
+    times = np.array([t for t, _ in races], dtype=np.int64)
+    records = np.array([r for _, r in races], dtype=np.int64)
+    disc = times * times - 4 * records
+    root = np.sqrt(np.maximum(disc, 0).astype(np.float64)).astype(np.int64)
+    # The float square root can be off by one: fix it to the integer square root.
+    root = np.where(root * root > disc, root - 1, root)
+    root = np.where((root + 1) * (root + 1) <= disc, root + 1, root)
+    low = np.maximum((times - root) // 2, 0)
+    for _ in range(2):
+        low = np.where((low > 0) & ((times - low + 1) * (low - 1) > records), low - 1, low)
+    for _ in range(2):
+        low = np.where((times - low) * low <= records, low + 1, low)
+    return np.where(disc > 0, np.maximum(times - 2 * low + 1, 0), 0)
 
 
 def test_ways_to_beat_record():
@@ -39,6 +84,20 @@ def test_ways_to_beat_record():
     ] == [4, 8, 9]
 
 
+@pytest.mark.parametrize("race_time", range(30))
+def test_ways_to_beat_record_exhaustive(race_time):
+    for record in range(-2, race_time * race_time // 4 + 3):
+        expected = sum(dist > record for dist in distances(race_time))
+        assert ways_to_beat_record(race_time, record) == expected
+
+
+def test_ways_to_beat_records():
+    races = [*TEST_INPUT, *INPUT, (0, 0), (4, 4), (3, 2), (10, -1)]
+    expected = [ways_to_beat_record(race_time, record) for race_time, record in races]
+    assert list(ways_to_beat_records(races)) == expected
+    assert list(ways_to_beat_records([(10**20, 10**30)])) == [ways_to_beat_record(10**20, 10**30)]
+
+
 def part1(times_records):
     return math.prod(
         ways_to_beat_record(race_time, record) for race_time, record in times_records
@@ -1,8 +1,19 @@
 # https://adventofcode.com/2023/day/07
 
+import array
 import collections
+import contextlib
+import functools
+import heapq
 import itertools
-from dataclasses import dataclass
+import operator
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
 
 import pytest
 
@@ -30,22 +41,134 @@ TYPES = {
     (1,1,1,1,1,): "Thigh",
 }
 
+TYPE_RANK = {type: rank for rank, type in enumerate(sorted(TYPES.values()))}
 
-@dataclass
+# Joker rules: (number of jokers, sorted counts of all the cards): type
+TYPES_2B = {
+    (0, (5,)): "Zfive",
+    (5, (5,)): "Zfive",
+    (0, (1,4,)): "Yfour",
+    (1, (1,4,)): "Zfive",
+    (4, (1,4,)): "Zfive",
+    (1, (1,1,3,)): "Yfour",
+    (0, (2,3,)): "Xfull",
+    (2, (2,3,)): "Zfive",
+    (3, (2,3,)): "Zfive",
+    (0, (1,1,3,)): "Wthree",
+    (1, (1,1,3,)): "Yfour",
+    (3, (1,1,3,)): "Yfour",
+    (0, (1,2,2,)): "Vpair",
+    (1, (1,2,2,)): "Xfull",
+    (2, (1,2,2,)): "Yfour",
+    (0, (1,1,1,2,)): "Upair",
+    (1, (1,1,1,2,)): "Wthree",
+    (2, (1,1,1,2,)): "Wthree",
+    (0, (1,1,1,1,1,)): "Thigh",
+    (1, (1,1,1,1,1,)): "Upair",
+}
+
+
+# There are only 13**5 possible hands, so classify them all once into a table
+# indexed by hand_code.  Each byte has the type rank for the standard rules in
+# its low four bits, and for the joker rules in its high four bits.  The table
+# is saved to disk, so later runs only have to read it.
+
+TYPE_NAMES = sorted(TYPES.values())
+TYPE_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "day07_types.bin")
+
+
+def hand_code(cards):
+    """The hand's cards as a base-13 number, for indexing the type table."""
+    code = 0
+    for card in cards:
+        code = code * 13 + CARD_STRENGTH[card]
+    return code
+
+
+def table_byte(strengths):
+    """The type table entry for a hand, given as a tuple of its card strengths."""
+    counts = tuple(sorted(collections.Counter(strengths).values()))
+    jokers = strengths.count(CARD_STRENGTH["J"])
+    return TYPE_RANK[TYPES[counts]] | TYPE_RANK[TYPES_2B[(jokers, counts)]] << 4
+
+
+def build_type_table():
+    return bytes(map(table_byte, itertools.product(range(13), repeat=5)))
+
+
+# The saved table starts with a header, so an unrelated file isn't trusted, and
+# a few hands are spot-checked, so a table saved with other rules isn't either.
+TYPE_TABLE_HEADER = b"day07 type table v1\n"
+SPOT_CHECK_HANDS = ["AAAAA", "AA8AA", "23332", "TTT98", "23432", "A23A4", "23456", "KTJJT", "JJJJ2"]
+
+
+def valid_type_table(table):
+    if len(table) != 13**5:
+        return False
+    for cards in SPOT_CHECK_HANDS:
+        if table[hand_code(cards)] != table_byte(tuple(CARD_STRENGTH[c] for c in cards)):
+            return False
+    return True
+
+
+def load_type_table(fname=TYPE_TABLE_FILE):
+    """Read the type table from `fname`, building it and trying to save it if needed.
+
+    If the file can't be written, the table is still built and used.
+    """
+    try:
+        with open(fname, "rb") as f:
+            data = f.read()
+    except OSError:
+        data = b""
+    if data.startswith(TYPE_TABLE_HEADER):
+        table = data[len(TYPE_TABLE_HEADER) :]
+        if valid_type_table(table):
+            return table
+    table = build_type_table()
+    temp_name = f"{fname}.{os.getpid()}.tmp"
+    try:
+        with open(temp_name, "wb") as f:
+            f.write(TYPE_TABLE_HEADER + table)
+        os.replace(temp_name, fname)
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(temp_name)
+    return table
+
+
+@functools.cache
+def type_table():
+    return load_type_table()
+
+
+def table_type(cards, jokers=False):
+    """Look up the type of a hand, for the standard rules or the joker rules."""
+    ranks = type_table()[hand_code(cards)]
+    return TYPE_NAMES[ranks >> 4 if jokers else ranks & 0xF]
+
+
+def hand_key(type, cards, card_strength):
+    """Pack a hand's type and card strengths into one int that sorts like the hand."""
+    key = TYPE_RANK[type]
+    for card in cards:
+        key = key * 13 + card_strength[card]
+    return key
+
+
+@dataclass(slots=True)
 class Hand:
     cards: str
     bid: int = 0
+    type: str = field(init=False, compare=False)
+    key: int = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
-        self.type = TYPES[tuple(sorted(collections.Counter(self.cards).values()))]
+        self.type = table_type(self.cards)
+        self.key = hand_key(self.type, self.cards, CARD_STRENGTH)
 
     def __lt__(self, other):
-        if self.type == other.type:
-            strengths1 = [CARD_STRENGTH[c] for c in self.cards]
-            strengths2 = [CARD_STRENGTH[c] for c in other.cards]
-            return strengths1 < strengths2
-        else:
-            return self.type < other.type
+        return self.key < other.key
 
 
 @pytest.mark.parametrize(
@@ -96,9 +219,16 @@ def test_hand_compare2():
     assert [h.cards for h in hands] == ["32T3K", "KTJJT", "KK677", "T55J5", "QQQJA"]
 
 
+def test_hand_key():
+    assert hand_key("Thigh", "23456", CARD_STRENGTH) == int("01234", 13)
+    assert hand_key("Upair", "2345A", CARD_STRENGTH) == int("10123C", 13)
+    assert Hand("AAAAA").key == 7 * 13**5 - 1
+    assert Hand("33332").key > Hand("2AAAA").key
+
+
 def part1(lines, klass=Hand):
     hands = parse_hands(lines, klass=klass)
-    hands.sort()
+    hands.sort(key=operator.attrgetter("key"))
     return sum(rank * hand.bid for rank, hand in enumerate(hands, start=1))
 
 
@@ -119,40 +249,44 @@ def multi_replace(s, olds, news):
         s = s.replace(old, new)
     return s
 
-# Part 2, first code: find real hands that jokers could represent.
-
-@dataclass
+# Part 2, first code: find real hands that jokers could represent.  This is
+# too slow to do for every hand, so Hand2 looks its type up in the type table,
+# and enumerated_joker_type is kept as the reference the table is checked
+# against.
+
+def enumerated_joker_type(cards):
+    jokers = cards.count("J")
+    nonj = list({c for c in cards if c != "J"})
+    match jokers:
+        case 5:
+            best = Hand("AAAAA")
+        case 4:
+            best = Hand(nonj[0] * 5)
+        case 3:
+            best = Hand(cards.replace("J", nonj[0]))
+        case 1 | 2:
+            candidates = []
+            for js in itertools.combinations_with_replacement(nonj, r=jokers):
+                candidates.append(Hand(multi_replace(cards, "J" * jokers, js)))
+            best = max(candidates)
+        case 0:
+            best = Hand(cards)
+    return best.type
+
+
+@dataclass(slots=True)
 class Hand2:
     cards: str
     bid: int = 0
+    type: str = field(init=False, compare=False)
+    key: int = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
-        jokers = self.cards.count("J")
-        nonj = list({c for c in self.cards if c != "J"})
-        match jokers:
-            case 5:
-                best = Hand("AAAAA")
-            case 4:
-                best = Hand(nonj[0] * 5)
-            case 3:
-                best = Hand(self.cards.replace("J", nonj[0]))
-            case 1 | 2:
-                candidates = []
-                for js in itertools.combinations_with_replacement(nonj, r=jokers):
-                    candidates.append(Hand(multi_replace(self.cards, "J" * jokers, js)))
-                best = max(candidates)
-            case 0:
-                best = Hand(self.cards)
-
-        self.type = best.type
+        self.type = table_type(self.cards, jokers=True)
+        self.key = hand_key(self.type, self.cards, CARD_STRENGTH2)
 
     def __lt__(self, other):
-        if self.type == other.type:
-            strengths1 = [CARD_STRENGTH2[c] for c in self.cards]
-            strengths2 = [CARD_STRENGTH2[c] for c in other.cards]
-            return strengths1 < strengths2
-        else:
-            return self.type < other.type
+        return self.key < other.key
 
 
 def part2(lines):
@@ -168,48 +302,12 @@ if __name__ == "__main__":
     print(f"Part 2: {answer = }")
 
 
-# Part 2, second code: no need to find real hands, just use counts.
-
-TYPES_2B = {
-    (0, (5,)): "Zfive",
-    (5, (5,)): "Zfive",
-    (0, (1,4,)): "Yfour",
-    (1, (1,4,)): "Zfive",
-    (4, (1,4,)): "Zfive",
-    (1, (1,1,3,)): "Yfour",
-    (0, (2,3,)): "Xfull",
-    (2, (2,3,)): "Zfive",
-    (3, (2,3,)): "Zfive",
-    (0, (1,1,3,)): "Wthree",
-    (1, (1,1,3,)): "Yfour",
-    (3, (1,1,3,)): "Yfour",
-    (0, (1,2,2,)): "Vpair",
-    (1, (1,2,2,)): "Xfull",
-    (2, (1,2,2,)): "Yfour",
-    (0, (1,1,1,2,)): "Upair",
-    (1, (1,1,1,2,)): "Wthree",
-    (2, (1,1,1,2,)): "Wthree",
-    (0, (1,1,1,1,1,)): "Thigh",
-    (1, (1,1,1,1,1,)): "Upair",
-}
-
-@dataclass
-class Hand2b:
-    cards: str
-    bid: int = 0
-
-    def __post_init__(self):
-        jokers = self.cards.count("J")
-        real_counts = tuple(sorted(collections.Counter(self.cards).values()))
-        self.type = TYPES_2B[(jokers, real_counts)]
+# Part 2, second code: no need to find real hands, just use counts.  TYPES_2B,
+# near the top, gives the type from the joker count and the card counts.  That
+# is how build_type_table classifies joker hands, so Hand2 already works this
+# way, and Hand2b is the same class.
 
-    def __lt__(self, other):
-        if self.type == other.type:
-            strengths1 = [CARD_STRENGTH2[c] for c in self.cards]
-            strengths2 = [CARD_STRENGTH2[c] for c in other.cards]
-            return strengths1 < strengths2
-        else:
-            return self.type < other.type
+Hand2b = Hand2
 
 def part2b(lines):
     return part1(lines, klass=Hand2b)
@@ -221,3 +319,165 @@ def test_part2b():
 if __name__ == "__main__":
     answer = part2b(file_lines("day07_input.txt"))
     print(f"Part 2b: {answer = }")
+
+
+def test_load_type_table(tmp_path):
+    fname = tmp_path / "types.bin"
+    table = load_type_table(fname)
+    assert fname.read_bytes() == TYPE_TABLE_HEADER + table
+    assert load_type_table(fname) == table
+    # A stale table of the right size is rebuilt.
+    fname.write_bytes(TYPE_TABLE_HEADER + bytes(13**5))
+    assert load_type_table(fname) == table
+    assert fname.read_bytes() == TYPE_TABLE_HEADER + table
+    # A directory that can't be written to still gets a table.
+    assert load_type_table(tmp_path / "missing" / "types.bin") == table
+    assert table[hand_code("AAAAA")] == TYPE_RANK["Zfive"] | TYPE_RANK["Zfive"] << 4
+    assert table[hand_code("KTJJT")] == TYPE_RANK["Vpair"] | TYPE_RANK["Yfour"] << 4
+
+
+def test_table_type_jokers():
+    # Check the joker rules against the first code, which tries real hands.
+    rand = random.Random(7)
+    hands = ["".join(rand.choices("23456789TJQKA", k=5)) for _ in range(500)]
+    hands += ["JJJJJ", "JJJJ2", "JJJ22", "JJ234", "J2345", "J2233"]
+    for cards in hands:
+        assert table_type(cards, jokers=True) == enumerated_joker_type(cards)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    table = build_type_table()
+    build_secs = time.perf_counter() - start
+    print(f"Type table: built in {build_secs:.3f}s, {sys.getsizeof(table):,} bytes")
+    hands = ["".join(random.choices("23456789TJQKA", k=5)) for _ in range(1_000_000)]
+    start = time.perf_counter()
+    for cards in hands:
+        table_type(cards)
+    lookup_secs = time.perf_counter() - start
+    print(f"Type table: {len(hands) / lookup_secs:,.0f} lookups/s")
+
+
+# External-memory ranking, for more hands than fit in memory: hands become
+# fixed-size (key, seq, bid) records, sorted in runs of bounded size that are
+# spilled to temp files, and the runs are merged while the winnings add up.
+# The input sequence number breaks ties between equal hands, keeping them in
+# input order like part1's stable sort.
+
+RECORD = struct.Struct("<IQQ")
+
+
+def write_run(records, dirname):
+    """Sort `records` and write them to a new file in `dirname`, returning its name."""
+    records.sort()
+    with tempfile.NamedTemporaryFile("wb", dir=dirname, delete=False) as f:
+        for record in records:
+            f.write(RECORD.pack(*record))
+    return f.name
+
+
+def read_run(fname, batch=4096):
+    with open(fname, "rb") as f:
+        while data := f.read(RECORD.size * batch):
+            yield from RECORD.iter_unpack(data)
+
+
+def external_winnings(lines, klass=Hand, run_size=1_000_000):
+    """Compute the total winnings, holding at most `run_size` hands in memory."""
+    with tempfile.TemporaryDirectory() as dirname:
+        runs = []
+        records = []
+        for seq, line in enumerate(lines):
+            cards, bid = line.split()
+            records.append((klass(cards).key, seq, int(bid)))
+            if len(records) == run_size:
+                runs.append(write_run(records, dirname))
+                records = []
+        if records:
+            runs.append(write_run(records, dirname))
+        merged = heapq.merge(*(read_run(run) for run in runs))
+        return sum(rank * bid for rank, (_, _, bid) in enumerate(merged, start=1))
+
+
+@pytest.mark.parametrize("run_size", [1, 2, 5, 100])
+def test_external_winnings(run_size):
+    assert external_winnings(TEST_INPUT, run_size=run_size) == 6440
+    assert external_winnings(TEST_INPUT, klass=Hand2b, run_size=run_size) == 5905
+    # Equal hands keep their input order, as in part1's stable sort.
+    ties = ["AAAAA 5", "AAAAA 1"]
+    assert external_winnings(ties, run_size=run_size) == part1(ties) == 7
+
+
+if __name__ == "__main__":
+    answer1 = external_winnings(file_lines("day07_input.txt"), run_size=100)
+    answer2 = external_winnings(file_lines("day07_input.txt"), klass=Hand2b, run_size=100)
+    print(f"External sort: {answer1 = }, {answer2 = }")
+
+
+# Incremental winnings as hands arrive.  Keys are bounded, so Fenwick trees over
+# the key space can count hands and sum bids below any key.  A new hand's rank
+# is one more than the number of hands at or below its key, and every hand
+# above it moves up one rank, adding their bids to the total.
+
+NUM_KEYS = len(TYPES) * 13**5
+
+
+class Fenwick:
+    """A binary indexed tree of int64s, for prefix sums with point updates."""
+
+    def __init__(self, size):
+        self.tree = array.array("q", bytes(8 * (size + 1)))
+
+    def add(self, i, delta):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, i):
+        """The sum of entries [0, i)."""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+class Winnings:
+    """The total winnings, kept up to date as hands are added."""
+
+    def __init__(self, klass=Hand):
+        self.klass = klass
+        self.counts = Fenwick(NUM_KEYS)
+        self.bids = Fenwick(NUM_KEYS)
+        self.total_bids = 0
+        self.total = 0
+
+    def add(self, cards, bid):
+        """Add a hand, and return the new total winnings."""
+        key = self.klass(cards).key
+        rank = self.counts.prefix_sum(key + 1) + 1
+        bids_above = self.total_bids - self.bids.prefix_sum(key + 1)
+        self.total += rank * bid + bids_above
+        self.counts.add(key, 1)
+        self.bids.add(key, bid)
+        self.total_bids += bid
+        return self.total
+
+
+def test_winnings():
+    for klass in [Hand, Hand2b]:
+        winnings = Winnings(klass)
+        for i, line in enumerate(TEST_INPUT, start=1):
+            cards, bid = line.split()
+            assert winnings.add(cards, int(bid)) == part1(TEST_INPUT[:i], klass=klass)
+    assert winnings.total == part2(TEST_INPUT)
+
+
+if __name__ == "__main__":
+    for klass in [Hand, Hand2b]:
+        winnings = Winnings(klass)
+        for line in file_lines("day07_input.txt"):
+            cards, bid = line.split()
+            winnings.add(cards, int(bid))
+        print(f"Incremental {klass.__name__}: {winnings.total = }")
@@ -1,8 +1,12 @@
 # https://adventofcode.com/2023/day/08
 
+import array
 import itertools
 import math
+import multiprocessing
+import random
 import re
+import time
 from dataclasses import dataclass
 
 from helpers import *
@@ -91,3 +95,388 @@ def test_part2():
 if __name__ == "__main__":
     answer = part2(file_lines("day08_input.txt"))
     print(f"Part 2: {answer = }")
+
+
+# Part 2, general: don't assume each ghost reaches a Z node on a clean cycle.
+# A ghost's state is (node, instruction index), so its walk is a tail followed
+# by a cycle.  Find each ghost's Z hits in the tail and in the cycle, then
+# combine the ghosts with the Chinese remainder theorem.
+
+@dataclass
+class GhostCycle:
+    tail: int               # Steps before the cycle starts.
+    cycle: int              # Length of the cycle.
+    tail_hits: set[int]     # Steps before the cycle that land on a Z node.
+    cycle_hits: list[int]   # Steps in [tail, tail + cycle) that land on a Z node.
+
+    def hits(self, steps):
+        """Does the ghost land on a Z node after `steps` steps?"""
+        if steps < self.tail:
+            return steps in self.tail_hits
+        return self.tail + (steps - self.tail) % self.cycle in self.cycle_hits
+
+
+def analyze_ghost(left_right, nodes, node):
+    seen = {}
+    hits = []
+    steps = 0
+    while (node, steps % len(left_right)) not in seen:
+        seen[node, steps % len(left_right)] = steps
+        if steps and node.endswith("Z"):
+            hits.append(steps)
+        node = nodes[node][left_right[steps % len(left_right)] == "R"]
+        steps += 1
+    tail = seen[node, steps % len(left_right)]
+    return GhostCycle(
+        tail=tail,
+        cycle=steps - tail,
+        tail_hits={h for h in hits if h < tail},
+        cycle_hits=[h for h in hits if h >= tail],
+    )
+
+
+def crt(a1, m1, a2, m2):
+    """Solve x = a1 mod m1, x = a2 mod m2, for moduli that needn't be coprime.
+
+    Returns (x, lcm), or None if there's no solution.
+    """
+    g = math.gcd(m1, m2)
+    if (a2 - a1) % g:
+        return None
+    k = (a2 - a1) // g * pow(m1 // g, -1, m2 // g) % (m2 // g)
+    lcm = m1 // g * m2
+    return (a1 + m1 * k) % lcm, lcm
+
+
+def test_crt():
+    assert crt(2, 3, 3, 5) == (8, 15)
+    assert crt(1, 4, 3, 6) == (9, 12)
+    assert crt(1, 4, 2, 6) is None
+
+
+def first_common_hit(ghosts):
+    """Find the fewest steps (at least one) that put every ghost on a Z node."""
+    if not ghosts:
+        # With no ghosts, every step qualifies, as with math.lcm() in part2.
+        return 1
+    # Before every ghost is in its cycle: check the tail hits of the slowest one.
+    slowest = max(ghosts, key=lambda g: g.tail)
+    for steps in sorted(slowest.tail_hits):
+        if all(g.hits(steps) for g in ghosts):
+            return steps
+    # After that, every ghost's hits are periodic: combine them with CRT.
+    start = max(slowest.tail, 1)
+    residues = {(0, 1)}
+    for g in ghosts:
+        residues = {
+            solved
+            for a, m in residues
+            for hit in g.cycle_hits
+            if (solved := crt(a, m, hit % g.cycle, g.cycle)) is not None
+        }
+    if not residues:
+        return None
+    return min(start + (a - start) % m for a, m in residues)
+
+
+def part2_cycles(lines):
+    left_right, nodes = parse_input(lines)
+    ghosts = [analyze_ghost(left_right, nodes, node) for node in nodes if node.endswith("A")]
+    return first_common_hit(ghosts)
+
+
+TEST_INPUT3 = string_lines("""\
+L
+
+11A = (11Z, 11Z)
+11Z = (11B, 11B)
+11B = (11C, 11C)
+11C = (11Z, 11Z)
+22A = (22B, 22B)
+22B = (22Z, 22Z)
+22Z = (22Z, 22Z)
+""")
+
+
+def brute_force(lines, limit=1000):
+    left_right, nodes = parse_input(lines)
+    my_nodes = [node for node in nodes if node.endswith("A")]
+    for steps, lr in enumerate(itertools.islice(itertools.cycle(left_right), limit), start=1):
+        my_nodes = [nodes[node][lr == "R"] for node in my_nodes]
+        if all(node.endswith("Z") for node in my_nodes):
+            return steps
+    return None
+
+
+def test_analyze_ghost():
+    left_right, nodes = parse_input(TEST_INPUT3)
+    assert analyze_ghost(left_right, nodes, "11A") == GhostCycle(1, 3, set(), [1])
+    assert analyze_ghost(left_right, nodes, "22A") == GhostCycle(2, 1, set(), [2])
+
+
+def test_part2_cycles():
+    assert part2_cycles(TEST_INPUT2) == 6
+    assert part2_cycles(TEST_INPUT3) == brute_force(TEST_INPUT3) == 4
+    assert part2(TEST_INPUT3) != 4
+    no_ghosts = ["L", "", "BBB = (ZZZ, ZZZ)", "ZZZ = (ZZZ, ZZZ)"]
+    assert part2_cycles(no_ghosts) == part2(no_ghosts) == 1
+
+
+def random_map(rand):
+    names = ["00A"] + [f"{i:02}{rand.choice('ABBBBBZ')}" for i in range(1, rand.randrange(3, 16))]
+    lines = ["".join(rand.choices("LR", k=rand.randrange(1, 7))), ""]
+    for name in names:
+        lines.append(f"{name} = ({rand.choice(names)}, {rand.choice(names)})")
+    return lines
+
+
+def test_part2_cycles_random():
+    rand = random.Random(8)
+    for _ in range(300):
+        lines = random_map(rand)
+        expected = brute_force(lines, limit=5000)
+        answer = part2_cycles(lines)
+        if expected is None:
+            assert answer is None or answer > 5000
+        else:
+            assert answer == expected
+
+
+if __name__ == "__main__":
+    answer = part2_cycles(file_lines("day08_input.txt"))
+    print(f"Part 2 cycles: {answer = }")
+
+
+# Compiled network: nodes become integer ids, with left and right moves in
+# arrays.  A table gives where each node lands after one full pass of the
+# instructions, and binary lifting tables double that: 2**k passes at once.
+
+@dataclass
+class Hits:
+    first: array.array          # First step of a pass from each node that hits a target, or 0.
+    within: list[bytearray]     # within[k][node]: does a target get hit within 2**k passes?
+
+
+class Network:
+    def __init__(self, left_right, nodes, walk=True):
+        """Compile the network.
+
+        With `walk` false, the one-pass table isn't made: set it with
+        set_pass_ends, from pieces made with walk_pass.
+        """
+        self.left_right = left_right
+        self.names = list(nodes)
+        self.ids = {name: id for id, name in enumerate(self.names)}
+        self.left = array.array("l", (self.ids[left] for left, _ in nodes.values()))
+        self.right = array.array("l", (self.ids[right] for _, right in nodes.values()))
+        self.passes = []
+        if walk:
+            ends, _ = self.walk_pass(range(len(self.names)))
+            self.set_pass_ends(ends)
+
+    def set_pass_ends(self, ends):
+        """Use `ends`, where one pass from each node ends, as the first lifting table."""
+        self.passes = [ends]
+
+    def step(self, node, index):
+        """Take the step for instruction number `index`."""
+        if self.left_right[index % len(self.left_right)] == "R":
+            return self.right[node]
+        return self.left[node]
+
+    def walk_pass(self, ids, target_ids=frozenset()):
+        """Walk one full pass from each node in `ids`.
+
+        Returns arrays of where each pass ends, and of the first step in it
+        that lands on one of `target_ids` (0 if none).
+        """
+        ends = array.array("l")
+        firsts = array.array("l")
+        for id in ids:
+            node = id
+            first = 0
+            for index in range(len(self.left_right)):
+                node = self.step(node, index)
+                if not first and node in target_ids:
+                    first = index + 1
+            ends.append(node)
+            firsts.append(first)
+        return ends, firsts
+
+    def pass_table(self, k):
+        """Where each node lands after 2**k passes, making the lifting tables as needed."""
+        while len(self.passes) <= k:
+            prev = self.passes[-1]
+            self.passes.append(array.array("l", (prev[prev[n]] for n in range(len(prev)))))
+        return self.passes[k]
+
+    def hits_in_pass(self, targets):
+        """Make the Hits tables for reaching any of the names in `targets`."""
+        target_ids = {self.ids[name] for name in targets}
+        _, first = self.walk_pass(range(len(self.names)), target_ids)
+        return self.lift_hits(first)
+
+    def lift_hits(self, first):
+        """Make Hits from `first`, the first step of a pass from each node that hits a target."""
+        # The walk from a node repeats within len(names) passes, so that many
+        # passes without a hit means never.
+        within = [bytearray(bool(f) for f in first)]
+        for k in range(1, len(self.names).bit_length() + 1):
+            prev = within[-1]
+            passes = self.pass_table(k - 1)
+            within.append(bytearray(prev[n] or prev[passes[n]] for n in range(len(prev))))
+        return Hits(first, within)
+
+    def steps_to_hit(self, node, hits):
+        """Count the steps from node id `node` to a target, or None if it's never reached.
+
+        Descends the lifting levels, jumping 2**k passes whenever they don't
+        reach a target, so it takes O(log N) jumps for a walk of N steps.
+        """
+        if not hits.within[-1][node]:
+            return None
+        steps = 0
+        for k in reversed(range(len(hits.within) - 1)):
+            if not hits.within[k][node]:
+                node = self.passes[k][node]
+                steps += len(self.left_right) << k
+        return steps + hits.first[node]
+
+    def jump_passes(self, node, npasses):
+        """Where `node` lands after `npasses` full passes, using the lifting tables."""
+        k = 0
+        while npasses:
+            if npasses & 1:
+                node = self.pass_table(k)[node]
+            npasses >>= 1
+            k += 1
+        return node
+
+    def position(self, name, steps):
+        """Where a walker starting at node `name` is after `steps` steps."""
+        npasses, rest = divmod(steps, len(self.left_right))
+        node = self.jump_passes(self.ids[name], npasses)
+        for index in range(rest):
+            node = self.step(node, index)
+        return self.names[node]
+
+
+def test_network_position():
+    left_right, nodes = parse_input(TEST_INPUT2)
+    network = Network(left_right, nodes)
+    for start in ["11A", "22A"]:
+        node = start
+        for steps, lr in enumerate(itertools.islice(itertools.cycle(left_right), 50), start=1):
+            node = nodes[node][lr == "R"]
+            assert network.position(start, steps) == node
+    assert network.position("22A", 3 * 10**9) == "22Z"
+
+
+def part1_compiled(lines):
+    network = Network(*parse_input(lines))
+    return network.steps_to_hit(network.ids["AAA"], network.hits_in_pass({"ZZZ"}))
+
+
+def test_part1_compiled():
+    assert part1_compiled(TEST_INPUT) == 6
+
+
+def test_steps_to_hit():
+    left_right, nodes = parse_input(TEST_INPUT2)
+    network = Network(left_right, nodes)
+    hits = network.hits_in_pass({"22Z"})
+    assert network.steps_to_hit(network.ids["22A"], hits) == 3
+    assert network.steps_to_hit(network.ids["11A"], hits) is None
+    rand = random.Random(20)
+    for _ in range(100):
+        lines = random_map(rand)
+        left_right, nodes = parse_input(lines)
+        network = Network(left_right, nodes)
+        hits = network.hits_in_pass(name for name in nodes if name.endswith("Z"))
+        node = "00A"
+        expected = None
+        for steps, lr in enumerate(itertools.islice(itertools.cycle(left_right), 1000), start=1):
+            node = nodes[node][lr == "R"]
+            if node.endswith("Z"):
+                expected = steps
+                break
+        assert network.steps_to_hit(network.ids["00A"], hits) == expected
+
+
+if __name__ == "__main__":
+    answer = part1_compiled(file_lines("day08_input.txt"))
+    print(f"Part 1 compiled: {answer = }")
+
+
+# Part 2, in parallel.  Once the tables are made, each ghost's walk is a few
+# table lookups, so the real work is walking every node through a full pass to
+# make the pass and hit tables.  That is split into chunks of nodes across a
+# process pool.  The network is sent to each worker once, when it starts,
+# rather than with every chunk, and the chunks are filled in as they complete.
+
+_worker_network = None
+_worker_target_ids = None
+
+
+def _init_walker(network, target_ids):
+    global _worker_network, _worker_target_ids
+    _worker_network = network
+    _worker_target_ids = target_ids
+
+
+def _walk_chunk(bounds):
+    start, end = bounds
+    ends, firsts = _worker_network.walk_pass(range(start, end), _worker_target_ids)
+    return start, ends, firsts
+
+
+def walk_ghosts(lines, processes=None, chunk_size=1000):
+    """Walk every ghost to its first Z node, making the tables in parallel.
+
+    Returns the answer, and a list of (start, steps, seconds) for each ghost.
+    The answer is None if some ghost never reaches a Z node, as with part2_cycles.
+    """
+    network = Network(*parse_input(lines), walk=False)
+    nnodes = len(network.names)
+    target_ids = frozenset(id for id, name in enumerate(network.names) if name.endswith("Z"))
+    ends = array.array("l", [0] * nnodes)
+    first = array.array("l", [0] * nnodes)
+    chunks = [(start, min(start + chunk_size, nnodes)) for start in range(0, nnodes, chunk_size)]
+    pool = multiprocessing.Pool(processes, initializer=_init_walker, initargs=(network, target_ids))
+    with pool:
+        for start, chunk_ends, chunk_firsts in pool.imap_unordered(_walk_chunk, chunks):
+            ends[start : start + len(chunk_ends)] = chunk_ends
+            first[start : start + len(chunk_firsts)] = chunk_firsts
+    network.set_pass_ends(ends)
+    hits = network.lift_hits(first)
+
+    reports = []
+    answer = 1
+    for name in network.names:
+        if name.endswith("A"):
+            start = time.perf_counter()
+            steps = network.steps_to_hit(network.ids[name], hits)
+            reports.append((name, steps, time.perf_counter() - start))
+            if steps is None:
+                answer = None
+            elif answer is not None:
+                answer = math.lcm(answer, steps)
+    return answer, reports
+
+
+def test_walk_ghosts():
+    answer, reports = walk_ghosts(TEST_INPUT2, processes=2, chunk_size=3)
+    assert answer == 6
+    assert sorted((name, steps) for name, steps, _ in reports) == [("11A", 2), ("22A", 3)]
+    lost = ["L", "", "AAA = (BBB, BBB)", "BBB = (BBB, BBB)", "11A = (11Z, 11Z)", "11Z = (11Z, 11Z)"]
+    answer, reports = walk_ghosts(lost, processes=2, chunk_size=1)
+    assert answer is None and part2_cycles(lost) is None
+    assert sorted((name, steps) for name, steps, _ in reports) == [("11A", 1), ("AAA", None)]
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    answer, reports = walk_ghosts(file_lines("day08_input.txt"), chunk_size=100)
+    for name, steps, secs in reports:
+        print(f"  {name}: {steps} steps in {secs * 1e6:.1f}us")
+    print(f"Part 2 parallel: {answer = }, in {time.perf_counter() - start:.3f}s")
@@ -1,6 +1,16 @@
 # https://adventofcode.com/2023/day/09
 
+import collections
+import fractions
+import functools
 import itertools
+import operator
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from helpers import *
 
@@ -62,3 +72,156 @@ def test_part2():
 if __name__ == "__main__":
     answer = part2(file_lines("day09_input.txt"))
     print(f"Part 2: {answer = }")
+
+
+# Batch mode, in closed form: the difference pyramid only works out if the
+# sequence is a polynomial of degree less than its length, so any value, ahead
+# or behind, is a fixed weighted sum of the inputs (Lagrange interpolation at
+# integer points).  For one step ahead, the weights are +/- binomials.
+
+@functools.cache
+def extrapolation_weights(length, steps):
+    """Weights for the value `steps` after the last of `length` values.
+
+    Negative steps go backward: -1 is the value just before the first.
+    """
+    target = length - 1 + steps if steps > 0 else steps
+    weights = []
+    for i in range(length):
+        weight = fractions.Fraction(1)
+        for j in range(length):
+            if j != i:
+                weight *= fractions.Fraction(target - j, i - j)
+        weights.append(int(weight))
+    return tuple(weights)
+
+
+def test_extrapolation_weights():
+    assert extrapolation_weights(3, 1) == (1, -3, 3)
+    assert extrapolation_weights(4, 1) == (-1, 4, -6, 4)
+    assert extrapolation_weights(3, -1) == (3, -3, 1)
+
+
+def extrapolate_batch(rows, steps=1):
+    """Extrapolate every row by `steps`, grouping the rows by length.
+
+    With NumPy, each group is one matrix-vector product, if int64 can't
+    overflow.  Otherwise the sums are exact Python ints.  The results are in
+    the same order as `rows`.
+    """
+    rows = list(rows)
+    by_length = collections.defaultdict(list)
+    for index, row in enumerate(rows):
+        by_length[len(row)].append(index)
+    results = [0] * len(rows)
+    for length, indexes in by_length.items():
+        group = [rows[index] for index in indexes]
+        weights = extrapolation_weights(length, steps)
+        biggest = max((abs(num) for row in group for num in row), default=0)
+        if np is not None and biggest * sum(map(abs, weights)) < 2**63:
+            matrix = np.array(group, dtype=np.int64)
+            values = (matrix @ np.array(weights, dtype=np.int64)).tolist()
+        else:
+            values = [sum(map(operator.mul, row, weights)) for row in group]
+        for index, value in zip(indexes, values):
+            results[index] = value
+    return results
+
+
+def test_extrapolate_batch():
+    seqs = parse_sequences(TEST_INPUT)
+    assert extrapolate_batch(seqs) == [18, 28, 68]
+    assert extrapolate_batch(seqs, steps=-1) == [-3, 0, 5]
+    assert extrapolate_batch(seqs, steps=2) == [21, 36, 101]
+    assert extrapolate_batch([[1, 2, 3], [10, 20, 30, 40], [5, 5, 5]]) == [4, 50, 5]
+    assert extrapolate_batch([[], [1, 2], []]) == [0, 3, 0]
+    assert extrapolate_batch([[10**20 * n * n for n in range(5)]]) == [10**20 * 25]
+
+
+def part1_batch(lines):
+    return sum(extrapolate_batch(parse_sequences(lines)))
+
+
+def part2_batch(lines):
+    return sum(extrapolate_batch(parse_sequences(lines), steps=-1))
+
+
+def test_part_batch():
+    assert part1_batch(TEST_INPUT) == 114
+    assert part2_batch(TEST_INPUT) == 2
+
+
+if __name__ == "__main__":
+    lines = file_lines("day09_input.txt")
+    print(f"Batch: {part1_batch(lines) = }, {part2_batch(lines) = }")
+
+
+# Streaming: for a live sequence, keep only the first and last entries of each
+# level of the difference pyramid.  Levels past `depth` are all zeros, so they
+# aren't stored, and a sequence that is a polynomial keeps a fixed depth.
+
+class Extrapolator:
+    __slots__ = ("count", "firsts", "lasts")
+
+    def __init__(self, nums=()):
+        self.count = 0
+        self.firsts = []
+        self.lasts = []
+        for num in nums:
+            self.append(num)
+
+    def append(self, num):
+        """Add the next value of the sequence, updating each stored level."""
+        diff = num
+        for level, last in enumerate(self.lasts):
+            self.lasts[level] = diff
+            diff -= last
+        if diff:
+            # The zero levels below get a non-zero entry: the new difference
+            # cascades down unchanged, since everything before it was zero.
+            for level in range(len(self.lasts), self.count + 1):
+                self.firsts.append(0 if level < self.count else diff)
+                self.lasts.append(diff)
+        self.count += 1
+
+    @property
+    def depth(self):
+        return len(self.lasts)
+
+    def next_value(self):
+        return sum(self.lasts)
+
+    def previous_value(self):
+        return sum(first if level % 2 == 0 else -first for level, first in enumerate(self.firsts))
+
+
+def test_extrapolator():
+    for seq, after, before in zip(parse_sequences(TEST_INPUT), [18, 28, 68], [-3, 0, 5]):
+        extrapolator = Extrapolator(seq)
+        assert extrapolator.next_value() == after
+        assert extrapolator.previous_value() == before
+    extrapolator.append(68)
+    assert extrapolator.next_value() == next_value([10, 13, 16, 21, 30, 45, 68])
+
+
+def test_extrapolator_bounded():
+    rand = random.Random(9)
+    coeffs = [rand.randrange(-50, 50) for _ in range(4)]
+    nums = [sum(c * n**i for i, c in enumerate(coeffs)) for n in range(200)]
+    extrapolator = Extrapolator()
+    for i, num in enumerate(nums, start=1):
+        extrapolator.append(num)
+        if i >= 5:
+            assert extrapolator.next_value() == next_value(nums[:i])
+            assert extrapolator.previous_value() == next_value(nums[:i][::-1])
+    assert extrapolator.depth == 4
+
+
+def test_extrapolator_arbitrary():
+    rand = random.Random(10)
+    nums = [rand.choice([0, 0, rand.randrange(-9, 10)]) for _ in range(30)]
+    extrapolator = Extrapolator()
+    for i, num in enumerate(nums, start=1):
+        extrapolator.append(num)
+        assert extrapolator.next_value() == extrapolate_batch([nums[:i]])[0]
+        assert extrapolator.previous_value() == extrapolate_batch([nums[:i]], steps=-1)[0]
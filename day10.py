@@ -1,6 +1,7 @@
 # https://adventofcode.com/2023/day/10
 
 import itertools
+import mmap
 import re
 from dataclasses import dataclass
 
@@ -65,15 +66,22 @@ def test_possible_steps():
 
 
 def loop_points(start, pipes):
+    """Produce each point of the loop once, in order, beginning with start."""
     x, y = start
-    yield x, y
     dx, dy = next(possible_steps(start, pipes))
-    x += dx; y += dy
-    while (x, y) != start:
+    while True:
+        yield x, y
+        x += dx; y += dy
+        if (x, y) == start:
+            break
         ch = pipes[x, y]
         dx, dy = NEXT_DIRECTIONS[(ch, (dx, dy))]
-        x += dx; y += dy
-        yield x, y
+
+def test_loop_points():
+    points = list(loop_points(*parse_pipes(TEST_INPUT)))
+    assert len(points) == len(set(points)) == 16
+    assert points[:3] == [(0, 2), (1, 2), (1, 1)]
+
 
 def part1(lines):
     start, pipes = parse_pipes(lines)
@@ -89,30 +97,25 @@ if __name__ == "__main__":
     print(f"Part 1: {answer = }")
 
 
+def enclosed_count(points):
+    """Use the shoelace formula and Pick's theorem to count points inside a loop.
+
+    `points` are the loop's points in order.  The shoelace formula gives the
+    loop's area, and Pick's theorem says area = inside + boundary / 2 - 1.
+    """
+    points = iter(points)
+    first = next(points)
+    twice_area = 0
+    boundary = 0
+    for (x1, y1), (x2, y2) in itertools.pairwise(itertools.chain([first], points, [first])):
+        twice_area += x1 * y2 - x2 * y1
+        boundary += 1
+    return (abs(twice_area) - boundary) // 2 + 1
+
+
 def part2(lines):
-    """Use even-odd counting to find points inside the loop."""
     start, pipes = parse_pipes(lines)
-    pipe_points = set(loop_points(start, pipes))
-    maxy = len(lines)
-    maxx = len(lines[0])
-    total_inside = 0
-    for y in range(maxy):
-        inside = False
-        on_horiz = None
-        for x in range(maxx):
-            if (x, y) in pipe_points:
-                pipe = pipes[x, y]
-                if pipe == "|":
-                    inside = not inside
-                elif pipe in "FL":
-                    on_horiz = pipe
-                elif pipe == "J" and on_horiz == "F":
-                    inside = not inside
-                elif pipe == "7" and on_horiz == "L":
-                    inside = not inside
-            elif inside:
-                total_inside += 1
-    return total_inside
+    return enclosed_count(loop_points(start, pipes))
 
 
 TEST_INPUT2 = string_lines("""\
@@ -127,11 +130,87 @@ TEST_INPUT2 = string_lines("""\
 ...........
 """)
 
+TEST_INPUT3 = string_lines("""\
+.F----7F7F7F7F-7....
+.|F--7||||||||FJ....
+.||.FJ||||||||L7....
+FJL7L7LJLJ||LJ.L-7..
+L--J.L7...LJS7F-7L7.
+....F-J..F7FJ|L7L7L7
+....L7.F7||L7|.L7L7|
+.....|FJLJ|FJ|F7|.LJ
+....FJL-7.||.||||...
+....L---J.LJ.LJLJ...
+""")
+
 def test_part2():
+    assert part2(TEST_INPUT) == 1
     assert part2(TEST_INPUT2) == 4
+    assert part2(TEST_INPUT3) == 8
 
 
 
 if __name__ == "__main__":
     answer = part2(file_lines("day10_input.txt"))
     print(f"Part 2: {answer = }")
+
+
+# For huge grids: don't parse the file at all.  Memory-map it, find S in the
+# bytes, and follow the loop by flat byte offsets, so only the loop's cells are
+# ever touched.  Directions are numbered 0-3, and NEXT_DIRECTION_TABLE[ch * 4 +
+# dir] is the direction out of pipe byte ch when entering it moving in dir.
+
+DIRECTIONS = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+NO_DIRECTION = 255
+NEXT_DIRECTION_TABLE = bytearray([NO_DIRECTION] * 256 * 4)
+for (ch, in_dir), out_dir in NEXT_DIRECTIONS.items():
+    NEXT_DIRECTION_TABLE[ord(ch) * 4 + DIRECTIONS.index(in_dir)] = DIRECTIONS.index(out_dir)
+
+
+def mmap_loop_points(fname):
+    """Produce each (x, y) point of the loop once, in order, reading a mapped file."""
+    with open(fname, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as grid:
+            stride = grid.find(b"\n") + 1 or len(grid) + 1
+            steps = [dy * stride + dx for dx, dy in DIRECTIONS]
+            start = grid.find(b"S")
+            for dir, step in enumerate(steps):
+                pos = start + step
+                if 0 <= pos < len(grid):
+                    if NEXT_DIRECTION_TABLE[grid[pos] * 4 + dir] != NO_DIRECTION:
+                        break
+            pos = start
+            while True:
+                yield divmod(pos, stride)[::-1]
+                pos += steps[dir]
+                if pos == start:
+                    break
+                dir = NEXT_DIRECTION_TABLE[grid[pos] * 4 + dir]
+
+
+def test_mmap_loop_points(tmp_path):
+    for lines in [TEST_INPUT, TEST_INPUT2, TEST_INPUT3]:
+        fname = tmp_path / "pipes.txt"
+        fname.write_text("\n".join(lines) + "\n")
+        start, pipes = parse_pipes(lines)
+        assert set(mmap_loop_points(fname)) == set(loop_points(start, pipes))
+        assert enclosed_count(mmap_loop_points(fname)) == part2(lines)
+
+
+def part1_mmap(fname):
+    return sum(1 for _ in mmap_loop_points(fname)) // 2
+
+
+def part2_mmap(fname):
+    return enclosed_count(mmap_loop_points(fname))
+
+
+def test_part_mmap(tmp_path):
+    fname = tmp_path / "pipes.txt"
+    fname.write_text("\n".join(TEST_INPUT))
+    assert part1_mmap(fname) == 8
+    assert part2_mmap(fname) == 1
+
+
+if __name__ == "__main__":
+    print(f"Mapped: {part1_mmap('day10_input.txt') = }, {part2_mmap('day10_input.txt') = }")